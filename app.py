@@ -1,17 +1,87 @@
 import streamlit as st
 import pandas as pd
 import google.generativeai as genai
-from gtts import gTTS
+import edge_tts
+import asyncio
 import io
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import requests
+from google.api_core.exceptions import DeadlineExceeded, ServiceUnavailable
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from streamlit_mic_recorder import speech_to_text
 
-def text_to_speech(text):
+TTS_VOICE = "en-US-JennyNeural"
+
+async def synthesize_speech(text, voice):
+    # Collect the MP3 chunks edge-tts sends over its websocket into one clip
+    audio_chunks = []
+    async for chunk in edge_tts.Communicate(text, voice).stream():
+        if chunk["type"] == "audio":
+            audio_chunks.append(chunk["data"])
+    return b"".join(audio_chunks)
+
+def text_to_speech(text, voice=TTS_VOICE):
     # Convert text to audio bytes
-    audio_bytes = io.BytesIO()
-    tts = gTTS(text=text, lang='en')
-    tts.write_to_fp(audio_bytes)
-    audio_bytes.seek(0)
-    return audio_bytes
+    return asyncio.run(synthesize_speech(text, voice))
+
+# Sentence boundaries used to start speech synthesis while the reply is still streaming
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+# Seconds to wait, once the reply has finished streaming, for all of its audio
+TTS_TIMEOUT = 15
+# Synthesized sentences kept across sessions, so a repeated line is synthesized once
+TTS_CACHE_SIZE = 128
+
+@st.cache_resource
+def tts_cache():
+    # Pool workers have no ScriptRunContext, so st.cache_data can't memoize calls made there;
+    # this cache is only read and written from script threads instead
+    return {"clips": OrderedDict(), "lock": threading.Lock()}
+
+def tts_pool():
+    # One pool per session, so a long reply never queues behind other users' audio
+    if "tts_pool" not in st.session_state:
+        st.session_state.tts_pool = ThreadPoolExecutor(max_workers=4)
+    return st.session_state.tts_pool
+
+def queue_speech(text):
+    # A cache hit comes back as an already-resolved future; only misses reach the pool
+    cache = tts_cache()
+    with cache["lock"]:
+        clip = cache["clips"].get((text, TTS_VOICE))
+        if clip is not None:
+            cache["clips"].move_to_end((text, TTS_VOICE))
+    if clip is None:
+        return text, tts_pool().submit(text_to_speech, text)
+    done = Future()
+    done.set_result(clip)
+    return text, done
+
+def collect_speech(jobs):
+    # Wait once for the whole reply, then keep the leading sentences that finished cleanly;
+    # anything still pending is cancelled so it doesn't keep occupying a worker
+    wait([fut for _, fut in jobs], timeout=TTS_TIMEOUT)
+    clips = []
+    cache = tts_cache()
+    for text, fut in jobs:
+        if not fut.done() or fut.cancelled() or fut.exception() is not None:
+            break
+        clips.append(fut.result())
+        with cache["lock"]:
+            cache["clips"][(text, TTS_VOICE)] = clips[-1]
+            cache["clips"].move_to_end((text, TTS_VOICE))
+            while len(cache["clips"]) > TTS_CACHE_SIZE:
+                cache["clips"].popitem(last=False)
+    for _, fut in jobs[len(clips):]:
+        fut.cancel()
+    return b"".join(clips), len(clips) == len(jobs)
 
 # ==========================================
 # 1. CONFIGURATION
@@ -22,49 +92,194 @@ GID = st.secrets["GID"]
 
 SHEET_URL = f"https://docs.google.com/spreadsheets/d/{SHEET_ID}/export?format=csv&gid={GID}"
 
-genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel('gemini-2.0-flash')
+MODEL_NAME = 'gemini-2.0-flash'
+
+# Built once per server process instead of on every script rerun; keyed on the case prompt,
+# so bounded to keep old cases and pre-edit prompts from piling up
+@st.cache_resource(max_entries=32)
+def get_model(system_instruction=None):
+    genai.configure(api_key=GOOGLE_API_KEY)
+    return genai.GenerativeModel(MODEL_NAME, system_instruction=system_instruction)
+
+@st.cache_resource
+def http_session():
+    # Pooled keep-alive connection for the sheet fetch
+    return requests.Session()
+
+model = get_model()
+
+# Gemini call limits (seconds): one-shot calls; the first streamed chunk, kept just above a
+# typical reply start so stragglers are retried early; the whole stream, which must fit a long
+# Grader summary; and total attempts
+REQUEST_TIMEOUT = 15
+FIRST_CHUNK_TIMEOUT = 8
+STREAM_TIMEOUT = 90
+MAX_ATTEMPTS = 2
+
+def stream_with_retry(prompt, on_text):
+    # Stream a reply from the session's ChatSession, calling on_text with the text so far;
+    # slow or unavailable calls are retried with a jittered backoff, and on_text("")
+    # signals that the reply restarted
+    for attempt in range(MAX_ATTEMPTS):
+        chat = st.session_state.chat
+        response = None
+        acc = []
+        try:
+            # send_message(stream=True) fetches the first chunk before returning, so bounding
+            # the call itself is the first-chunk deadline
+            executor = ThreadPoolExecutor(max_workers=1)
+            call = executor.submit(chat.send_message, prompt, stream=True, request_options={"timeout": STREAM_TIMEOUT})
+            executor.shutdown(wait=False)
+            try:
+                response = call.result(timeout=FIRST_CHUNK_TIMEOUT)
+            except FutureTimeoutError:
+                # The abandoned call may still land on this ChatSession later, so carry on with a copy
+                st.session_state.chat = chat.model.start_chat(history=list(chat.history))
+                raise DeadlineExceeded(f"No reply from Gemini within {FIRST_CHUNK_TIMEOUT}s")
+
+            for chunk in response:
+                acc.append(chunk.text)
+                on_text("".join(acc))
+            return "".join(acc)
+        except Exception as e:
+            # Drop the half-received turn so the ChatSession can send again; before
+            # send_message returns the SDK has recorded nothing, so there is nothing to rewind
+            if response is not None:
+                chat.rewind()
+            if attempt == MAX_ATTEMPTS - 1 or not isinstance(e, (DeadlineExceeded, ServiceUnavailable)):
+                raise
+            on_text("")
+            time.sleep(random.uniform(0.5, 1.5) * (2 ** attempt))
 
 # ==========================================
 # 2. DATA MANAGEMENT (Google Sheet Connection)
 # ==========================================
-@st.cache_data(ttl=60)
-def load_cases():
+# How often (seconds) to ask the sheet whether it changed
+SHEET_REFRESH_SECONDS = 60
+
+# Last-known-good sheet on local disk, so a cold start can skip the CSV parse
+CASES_FEATHER = os.path.join(tempfile.gettempdir(), "cases.feather")
+CASES_META = os.path.join(tempfile.gettempdir(), "cases.json")
+
+def read_disk_cache():
     try:
-        df = pd.read_csv(SHEET_URL, on_bad_lines='skip')
-        
-        rename_map = {
-            "Case Name": "Case_Name",
-            "Hidden Diagnosis": "Hidden_Diagnosis",
-            "Parent Persona": "Parent_Persona",
-            "Parent_Personae": "Parent_Persona",
-            "Chief Complaint": "Chief_Complaint",
-            "HPI Timeline": "HPI_Timeline",
-            "Symptom Visuals": "Symptom_Visuals",
-            "Symptom Behavior": "Symptom_Behavior",
-            "Medical History": "Medical_History",
-            "Medications": "Medications",
-            "Jargon Triggers": "Jargon_Triggers",
-            "Lab Results": "Lab_Results",
-            "Imaging Results": "Imaging_Results",
-            "Correct Mgmt": "Correct_Mgmt",
-            "Critical Pitfalls": "Critical_Pitfalls",
-            "Educational Pearl": "Educational_Pearl"
-        }
-        
-        df = df.rename(columns=rename_map)
-        df.columns = df.columns.str.strip()
+        with open(CASES_META) as f:
+            meta = json.load(f)
+        df = pd.read_feather(CASES_FEATHER).set_index('Case_Name', drop=False)
+        return df, meta.get("etag"), meta.get("last_modified")
+    except Exception:
+        return pd.DataFrame(), None, None
 
-        if 'Case_Name' in df.columns:
-            return df.dropna(subset=['Case_Name'])
-        else:
-            st.error("Error: Could not find 'Case_Name' even after cleaning. Check Sheet headers.")
-            return pd.DataFrame()
+def write_disk_cache(df, etag, last_modified):
+    try:
+        # Drop the sidecar first so a half-written cache is never trusted
+        if os.path.exists(CASES_META):
+            os.remove(CASES_META)
+        if not (etag or last_modified):
+            return
+        df.reset_index(drop=True).to_feather(CASES_FEATHER)
+        with open(CASES_META, "w") as f:
+            json.dump({"etag": etag, "last_modified": last_modified}, f)
+    except Exception:
+        pass
+
+@st.cache_resource
+def sheet_cache():
+    # Shared by every session: the last parsed sheet plus its HTTP validators
+    df, etag, last_modified = read_disk_cache()
+    return {
+        "df": df, "etag": etag, "last_modified": last_modified, "checked_at": 0.0,
+        "lock": threading.Lock(), "fetch_lock": threading.Lock()
+    }
+
+def parse_cases(csv_bytes):
+    # Every column is free text; skip dtype inference and NA detection
+    df = pd.read_csv(io.BytesIO(csv_bytes), on_bad_lines='skip', dtype=str, engine='c', na_filter=False)
+    
+    rename_map = {
+        "Case Name": "Case_Name",
+        "Hidden Diagnosis": "Hidden_Diagnosis",
+        "Parent Persona": "Parent_Persona",
+        "Parent_Personae": "Parent_Persona",
+        "Chief Complaint": "Chief_Complaint",
+        "HPI Timeline": "HPI_Timeline",
+        "Symptom Visuals": "Symptom_Visuals",
+        "Symptom Behavior": "Symptom_Behavior",
+        "Medical History": "Medical_History",
+        "Medications": "Medications",
+        "Jargon Triggers": "Jargon_Triggers",
+        "Lab Results": "Lab_Results",
+        "Imaging Results": "Imaging_Results",
+        "Correct Mgmt": "Correct_Mgmt",
+        "Critical Pitfalls": "Critical_Pitfalls",
+        "Educational Pearl": "Educational_Pearl"
+    }
+    
+    df = df.rename(columns=rename_map)
+    df.columns = df.columns.str.strip()
 
-    except Exception as e:
-        st.error(f"Connection Error: {e}")
+    if 'Case_Name' in df.columns:
+        # With na_filter off, blank cells come through as empty strings
+        df = df[df['Case_Name'].str.strip() != '']
+        # Index by name so case selection is a hash lookup; the first duplicate wins, as before
+        return df.drop_duplicates(subset='Case_Name').set_index('Case_Name', drop=False)
+    else:
+        st.error("Error: Could not find 'Case_Name' even after cleaning. Check Sheet headers.")
         return pd.DataFrame()
 
+def load_cases():
+    cache = sheet_cache()
+    with cache["lock"]:
+        due = time.time() - cache["checked_at"] >= SHEET_REFRESH_SECONDS
+        if not due and not cache["df"].empty:
+            return cache["df"]
+
+        # Claim the refresh window before the request, whatever its outcome: while the sheet
+        # is down or slow, other reruns don't pile on. fetch_lock is held for the whole fetch
+        fetching = due and cache["fetch_lock"].acquire(blocking=False)
+        if fetching:
+            cache["checked_at"] = time.time()
+
+            # Conditional GET: the sheet is only downloaded and parsed again when it changed
+            headers = {}
+            if cache["etag"]:
+                headers["If-None-Match"] = cache["etag"]
+            if cache["last_modified"]:
+                headers["If-Modified-Since"] = cache["last_modified"]
+
+    if not fetching:
+        if not cache["df"].empty:
+            return cache["df"]
+        # No good copy yet (e.g. a cold start with no Feather file): wait for the fetch in
+        # flight rather than showing an empty case list
+        with cache["fetch_lock"]:
+            return cache["df"]
+
+    # Network I/O happens outside the shared lock
+    try:
+        try:
+            r = http_session().get(SHEET_URL, headers=headers, timeout=REQUEST_TIMEOUT)
+            r.raise_for_status()
+            if r.status_code == 304:
+                return cache["df"]
+            df = parse_cases(r.content)
+
+        except Exception as e:
+            st.error(f"Connection Error: {e}")
+            return cache["df"]
+
+        etag = r.headers.get("ETag") if not df.empty else None
+        last_modified = r.headers.get("Last-Modified") if not df.empty else None
+        with cache["lock"]:
+            cache["df"] = df
+            cache["etag"] = etag
+            cache["last_modified"] = last_modified
+        write_disk_cache(df, etag, last_modified)
+        return df
+
+    finally:
+        cache["fetch_lock"].release()
+
 # ==========================================
 # 3. THE BRAIN (System Prompt)
 # ==========================================
@@ -79,7 +294,7 @@ def build_system_prompt(case):
     **Tone:** {case['Parent_Persona']}
     **Constraints:**
     1. You know ONLY what you observe.
-    2. You do NOT understand medical jargon triggers: [{case['Jargon_Triggers']}]. Act confused.
+    2. If a message carries a "Jargon used" note, you do NOT understand those terms. Act confused.
     3. You never reveal the diagnosis.
     
     **Data:**
@@ -108,35 +323,227 @@ def build_system_prompt(case):
     Start by stating the clinical environment ("Clinic Visit" or "Emergency Room") and then acting as the PARENT. State your Chief Complaint naturally. If non-contributory or irrelevant information is asked for during the session, provide details but be brief. 
     """
 
+def trigger_pattern(term):
+    # Guard only the edges that are word characters, so "(ABG)", "q.i.d." and "O2 sat %"
+    # still match, and allow a plural so "retraction" catches "retractions"
+    pattern = re.escape(term)
+    if re.match(r'\w', term):
+        pattern = r'(?<!\w)' + pattern
+    if re.search(r'\w$', term):
+        pattern += r'(?:e?s)?(?!\w)'
+    return pattern
+
+def compile_triggers(jargon_triggers):
+    # One alternation, longest term first, so overlapping triggers match the fuller phrase
+    triggers = sorted({t.strip().lower() for t in jargon_triggers.split(',') if t.strip()}, key=len, reverse=True)
+    if not triggers:
+        return None
+    return re.compile('|'.join(map(trigger_pattern, triggers)), re.IGNORECASE)
+
+def annotate_jargon(prompt, trigger_re):
+    # Only the triggers the user actually said are sent, instead of the whole list every turn
+    hits = sorted({m.group(0).lower() for m in trigger_re.finditer(prompt)}) if trigger_re else []
+    if not hits:
+        return prompt
+    return f"[Jargon used: {', '.join(hits)}]\n{prompt}"
+
 # ==========================================
-# 4. THE USER INTERFACE (Streamlit)
+# 4. SESSION MEMORY (Bounded Transcript)
+# ==========================================
+# Once the transcript passes MAX_MESSAGES, everything but the last KEEP_MESSAGES is summarized
+MAX_MESSAGES = 40
+KEEP_MESSAGES = 30
+
+def start_case_chat(sys_prompt, messages=()):
+    # The case prompt rides along as a system instruction rather than a fake opening turn
+    case_model = get_model(sys_prompt)
+    history = []
+    for msg in messages:
+        if msg.get("summary"):
+            # The summary is context, not something the model said, so it opens the history as a user turn
+            role, text = "user", f"Context from earlier in this session: {msg['content']}"
+        else:
+            role = "user" if msg["role"] == "user" else "model"
+            # Replay what Gemini actually saw, including any "Jargon used" note
+            text = msg.get("sent", msg["content"])
+        # Merge back-to-back turns from the same role (the summary and the first kept user turn)
+        if history and history[-1]["role"] == role:
+            history[-1]["parts"].append(text)
+        else:
+            history.append({"role": role, "parts": [text]})
+    return case_model.start_chat(history=history)
+
+def compact_history():
+    messages = st.session_state.messages
+    if len(messages) <= MAX_MESSAGES:
+        return
+
+    old = messages[:-KEEP_MESSAGES]
+    dialogue = "\n".join(f"{msg['role'].upper()}: {msg['content']}" for msg in old)
+    summary = model.generate_content(
+        f"Summarize this dialogue in 200 tokens or fewer, preserving all clinical facts:\n{dialogue}",
+        request_options={"timeout": REQUEST_TIMEOUT}
+    ).text
+
+    st.session_state.messages = [
+        {"role": "model", "content": f"[Prior turns summary]: {summary}", "summary": True}
+    ] + messages[-KEEP_MESSAGES:]
+    st.session_state.chat = start_case_chat(st.session_state.sys_prompt, st.session_state.messages)
+
+# ==========================================
+# 5. BATCH TOOLS (Offline Validation)
+# ==========================================
+OPENER_DELIMITER = re.compile(r'^\s*===\s*$', re.MULTILINE)
+
+def batch_generate_openers(cases_df, batch=8):
+    # Row-marshalling: pack several cases into one prompt to spend fewer rate-limited calls
+    openers = {}
+    for start in range(0, len(cases_df), batch):
+        chunk = cases_df.iloc[start:start + batch]
+        prompts = [
+            f"### CASE {i + 1}\n{build_system_prompt({k: str(v) for k, v in row.items()})}"
+            for i, (_, row) in enumerate(chunk.iterrows())
+        ]
+        prompt = "\n---\n".join(prompts) + (
+            f"\n\nFor each of the {len(prompts)} cases above, in order, write only the opening line "
+            "described in its IMMEDIATE INSTRUCTION. Separate the openers with a line containing only ==="
+        )
+        reply = model.generate_content(prompt, request_options={"timeout": REQUEST_TIMEOUT * 4}).text
+
+        parts = [p.strip() for p in OPENER_DELIMITER.split(reply) if p.strip()]
+        # A malformed reply leaves the whole batch as None rather than misaligning openers
+        for i, name in enumerate(chunk['Case_Name']):
+            openers[name] = parts[i] if len(parts) == len(prompts) else None
+    return openers
+
+# ==========================================
+# 6. THE USER INTERFACE (Streamlit)
 # ==========================================
 st.set_page_config(page_title="PedsSim Bot", page_icon="🩺")
 
 st.title("🩺 Pediatric History Trainer")
 st.warning("⚠️ **DISCLAIMER: Do not enter actual patient information. For simulation only.**")
 
+# The sidebar is a fragment: its widgets rerun only the sidebar, so toggling audio or
+# browsing cases doesn't redraw the transcript
+@st.fragment
+def sidebar(df):
+    st.header("Case Files")
+    case_names = df['Case_Name'].tolist()
+    selected_case_name = st.selectbox("Choose a Patient:", case_names)
+    
+    if st.button("Start / Reset Case", type="primary"):
+        st.session_state.messages = []
+        # Plain dict: cheaper to index than a pandas Series in build_system_prompt
+        st.session_state.current_case_data = {k: str(v) for k, v in df.loc[selected_case_name].items()}
+        st.session_state.sys_prompt = build_system_prompt(st.session_state.current_case_data)
+        st.session_state.chat = start_case_chat(st.session_state.sys_prompt)
+        st.session_state.trigger_re = compile_triggers(st.session_state.current_case_data['Jargon_Triggers'])
+        st.session_state.chat_started = True
+        st.rerun()
+        
+    st.divider()
+    
+    # --- AUDIO SETTINGS ---
+    # Read by the chat panel through session state
+    st.header("Audio Settings")
+    st.toggle("Enable Text-to-Speech Response", value=False, key="enable_audio")
+
+# Not a fragment: st.chat_input only pins to the bottom of the page from the main script,
+# and new turns must render above it
+def chat_panel(voice_text):
+    if "chat_started" not in st.session_state:
+        st.info("👈 Please select a case and click 'Start Case' in the sidebar.")
+        return
+
+    if "messages" not in st.session_state:
+        st.session_state.messages = []
+    enable_audio = st.session_state.get("enable_audio", False)
+
+    # Display History
+    # Streamlit drops whatever a rerun doesn't emit, so the whole transcript is redrawn; MAX_MESSAGES keeps it bounded
+    for message in st.session_state.messages:
+        if message.get("summary"):
+            st.caption("⏳ Earlier messages truncated")
+        role = "user" if message["role"] == "user" else "assistant"
+        with st.chat_message(role):
+            st.markdown(message["content"])
+
+    # Input Handling
+    chat_input_text = st.chat_input("Interview the parent...")
+
+    prompt = None
+    if chat_input_text:
+        prompt = chat_input_text
+    elif voice_text:
+        # just_once hands each recording over on a single run only, and this panel isn't a
+        # fragment, so a recording can't be replayed into a second Gemini call
+        prompt = voice_text
+
+    if prompt:
+        # 1. Display User Message
+        sent = annotate_jargon(prompt, st.session_state.trigger_re)
+        st.session_state.messages.append({"role": "user", "content": prompt, "sent": sent})
+        with st.chat_message("user"):
+            st.markdown(prompt)
+
+        # 2. Generate Response (the ChatSession carries the history)
+        tts_jobs = []
+        with st.chat_message("assistant"):
+            placeholder = st.empty()
+
+            # Render tokens in place as they arrive
+            def show(text):
+                placeholder.markdown(text)
+                if not text:
+                    # A retry restarts the reply; audio from the failed attempt is discarded
+                    for _, fut in tts_jobs:
+                        fut.cancel()
+                    tts_jobs.clear()
+                elif enable_audio:
+                    # Synthesize each finished sentence in the background while the rest streams
+                    *sentences, _ = SENTENCE_END.split(text)
+                    tts_jobs.extend(queue_speech(s) for s in sentences[len(tts_jobs):])
+
+            try:
+                ai_reply = stream_with_retry(sent, show)
+            except Exception as e:
+                # The ChatSession has already dropped the failed turn; drop it from the
+                # transcript too so the two stay in sync
+                st.session_state.messages.pop()
+                placeholder.empty()
+                st.error(f"AI Generation Error: {e}")
+                return
+
+        if enable_audio:
+            tail = SENTENCE_END.split(ai_reply)[len(tts_jobs):]
+            tts_jobs.extend(queue_speech(s) for s in tail if s.strip())
+
+        st.session_state.messages.append({"role": "model", "content": ai_reply})
+
+        try:
+            compact_history()
+        except Exception as e:
+            st.warning(f"Could not summarize earlier turns: {e}")
+
+        # --- AUDIO GENERATION (Fixed Logic) ---
+        if enable_audio:
+            # MP3 frames concatenate cleanly, so the sentence clips play back as one track
+            audio_data, complete = collect_speech(tts_jobs)
+            if audio_data:
+                st.audio(audio_data, format='audio/mp3')
+            if not complete:
+                st.error("Audio Generation Error: some of the reply could not be synthesized in time.")
+
 df = load_cases()
 
 if not df.empty:
     # --- Sidebar ---
     with st.sidebar:
-        st.header("Case Files")
-        case_names = df['Case_Name'].tolist()
-        selected_case_name = st.selectbox("Choose a Patient:", case_names)
-        
-        if st.button("Start / Reset Case", type="primary"):
-            st.session_state.messages = []
-            st.session_state.current_case_data = df[df['Case_Name'] == selected_case_name].iloc[0]
-            st.session_state.chat_started = True
-            st.rerun()
-            
-        st.divider()
-        
-        # --- AUDIO SETTINGS ---
-        st.header("Audio Settings")
-        enable_audio = st.toggle("Enable Text-to-Speech Response", value=False)
-        
+        sidebar(df)
+
+        # Kept outside the fragment: a finished recording must rerun the whole app
+        # so the chat panel receives the transcript
         st.header("🎤 Voice Input")
         voice_text = speech_to_text(
             language='en',
@@ -147,64 +554,7 @@ if not df.empty:
         )
 
     # --- Chat Logic ---
-    if "chat_started" not in st.session_state:
-        st.info("👈 Please select a case and click 'Start Case' in the sidebar.")
-    
-    else:
-        if "messages" not in st.session_state:
-            st.session_state.messages = []
-
-        # Display History
-        for message in st.session_state.messages:
-            role = "user" if message["role"] == "user" else "assistant"
-            with st.chat_message(role):
-                st.markdown(message["content"])
-
-        # Input Handling
-        chat_input_text = st.chat_input("Interview the parent...")
-
-        prompt = None
-        if chat_input_text:
-            prompt = chat_input_text
-        elif 'voice_text' in locals() and voice_text:
-            prompt = voice_text
-
-        if prompt:
-            # 1. Display User Message
-            st.session_state.messages.append({"role": "user", "content": prompt})
-            with st.chat_message("user"):
-                st.markdown(prompt)
-
-            # 2. Build Brain & History
-            sys_prompt = build_system_prompt(st.session_state.current_case_data)
-            gemini_history = [{"role": "user", "parts": [sys_prompt]}]
-            
-            for msg in st.session_state.messages:
-                role = "user" if msg["role"] == "user" else "model"
-                gemini_history.append({"role": role, "parts": [msg["content"]]})
-
-            # 3. Generate Response
-            try:
-                response = model.generate_content(gemini_history)
-                ai_reply = response.text
-                
-                st.session_state.messages.append({"role": "model", "content": ai_reply})
-                with st.chat_message("assistant"):
-                    st.markdown(ai_reply)
-
-                # --- AUDIO GENERATION (Fixed Logic) ---
-                if enable_audio:
-                    try:
-                        audio_data = text_to_speech(ai_reply)
-                        st.audio(audio_data, format='audio/mp3')
-                    except Exception as e:
-                        st.error(f"Audio Generation Error: {e}")
-
-            except Exception as e:
-                st.error(f"AI Generation Error: {e}")
+    chat_panel(voice_text)
 
 else:
     st.warning("Waiting for data... Please check your Google Sheet connection.")
-
-
-